@@ -7,24 +7,47 @@ from aws_cdk import (
     aws_iam as iam,
     aws_events as events,
     Duration,
+    Size,
     Stack
 )
 from constructs import Construct
 from lambda_main import constants
+from cdk_iam_cleaner.sizing import get_sizing
 from aws_cdk import CfnOutput
 
 
 class CdkLambdaDynamoDBStack(Stack):
 
     # lambda_function = _lambda.Function
-    def __init__(self, scope: Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, id: str, sizing: str = None, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
+        sizing = get_sizing(sizing or self.node.try_get_context('sizing'))
+        table_sizing = sizing['table']
+        function_sizing = sizing['function']
+        if table_sizing['billing'] == 'on_demand':
+            capacity = {'billing_mode': dynamodb.BillingMode.PAY_PER_REQUEST}
+        else:
+            capacity = {
+                'billing_mode': dynamodb.BillingMode.PROVISIONED,
+                'read_capacity': table_sizing['read_capacity'],
+                'write_capacity': table_sizing['write_capacity']
+            }
         lambda_dynamodb = LambdaToDynamoDB(self, 'iam-cleaner-function',
                                            lambda_function_props=_lambda.FunctionProps(
                                                code=_lambda.Code.from_asset('lambda_main'),
                                                runtime=_lambda.Runtime.PYTHON_3_9,
                                                handler='app.lambda_handler',
                                                tracing=_lambda.Tracing.DISABLED,
+                                               memory_size=function_sizing['memory_size'],
+                                               timeout=Duration.seconds(function_sizing['timeout']),
+                                               ephemeral_storage_size=Size.mebibytes(
+                                                   function_sizing['ephemeral_storage']),
+                                               reserved_concurrent_executions=function_sizing[
+                                                   'reserved_concurrency'],
+                                               environment={
+                                                   constants.WORKERS_ENV_VAR: str(function_sizing['workers']),
+                                                   constants.BATCH_SIZE_ENV_VAR: str(function_sizing['batch_size'])
+                                               },
                                                initial_policy=[
                                                    iam.PolicyStatement(
                                                        effect=iam.Effect.ALLOW,
@@ -43,11 +66,19 @@ class CdkLambdaDynamoDBStack(Stack):
                                                    'name': 'username',
                                                    'type': dynamodb.AttributeType.STRING
                                                },
-                                               billing_mode=dynamodb.BillingMode.PROVISIONED,
-                                               read_capacity=1,
-                                               write_capacity=1
+                                               **capacity
                                            )
                                            )
+        if table_sizing['billing'] == 'autoscaled':
+            table = lambda_dynamodb.dynamo_table
+            table.auto_scale_read_capacity(
+                min_capacity=table_sizing['read_capacity'],
+                max_capacity=table_sizing['max_read_capacity']
+            ).scale_on_utilization(target_utilization_percent=table_sizing['target_utilization'])
+            table.auto_scale_write_capacity(
+                min_capacity=table_sizing['write_capacity'],
+                max_capacity=table_sizing['max_write_capacity']
+            ).scale_on_utilization(target_utilization_percent=table_sizing['target_utilization'])
         resources = {
             "list-users-rule": {"week_day": "SUN"},
             "deactive-users-rule": {"day": "*/15"},
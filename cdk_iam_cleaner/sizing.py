@@ -0,0 +1,83 @@
+"""
+Perfiles de dimensionamiento para CdkLambdaDynamoDBStack.
+
+Cada perfil define la capacidad de la tabla de DynamoDB y los recursos de la
+función Lambda. Se selecciona con el contexto de CDK `sizing`
+(`cdk deploy -c sizing=bulk`) o con la entrada `sizing` de cdk.json.
+
+table:
+    billing: "provisioned", "autoscaled" u "on_demand".
+    read_capacity / write_capacity: capacidad fija (provisioned) o mínima (autoscaled).
+    max_read_capacity / max_write_capacity: capacidad máxima (autoscaled).
+    target_utilization: porcentaje de uso objetivo (autoscaled).
+function:
+    memory_size: memoria en MB.
+    timeout: tiempo máximo de ejecución en segundos.
+    ephemeral_storage: tamaño de /tmp en MiB.
+    reserved_concurrency: ejecuciones concurrentes reservadas (None para no reservar).
+    workers: hilos que usa el handler para consultar IAM en paralelo.
+    batch_size: usuarios por lote en las lecturas y escrituras de DynamoDB.
+"""
+DEFAULT_SIZING = "minimal"
+
+SIZING_PROFILES = {
+    "minimal": {
+        "table": {
+            "billing": "provisioned",
+            "read_capacity": 1,
+            "write_capacity": 1
+        },
+        "function": {
+            "memory_size": 128,
+            "timeout": 60,
+            "ephemeral_storage": 512,
+            "reserved_concurrency": None,
+            "workers": 1,
+            "batch_size": 25
+        }
+    },
+    "standard": {
+        "table": {
+            "billing": "on_demand"
+        },
+        "function": {
+            "memory_size": 512,
+            "timeout": 300,
+            "ephemeral_storage": 512,
+            "reserved_concurrency": None,
+            "workers": 4,
+            "batch_size": 50
+        }
+    },
+    "bulk": {
+        "table": {
+            "billing": "autoscaled",
+            "read_capacity": 5,
+            "write_capacity": 5,
+            "max_read_capacity": 100,
+            "max_write_capacity": 100,
+            "target_utilization": 70
+        },
+        "function": {
+            "memory_size": 1024,
+            "timeout": 900,
+            "ephemeral_storage": 2048,
+            "reserved_concurrency": 1,
+            "workers": 16,
+            "batch_size": 100
+        }
+    }
+}
+
+
+def get_sizing(name=None):
+    """
+    Devuelve el perfil de dimensionamiento con el nombre indicado.
+    :param name: nombre del perfil; si es None se usa DEFAULT_SIZING.
+    :return: dict con las llaves 'table' y 'function'; si no existe, lanza ValueError.
+    """
+    name = name or DEFAULT_SIZING
+    if name not in SIZING_PROFILES:
+        raise ValueError(f"Perfil de dimensionamiento desconocido: {name}. "
+                         f"Opciones: {', '.join(SIZING_PROFILES)}")
+    return SIZING_PROFILES[name]
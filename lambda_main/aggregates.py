@@ -0,0 +1,191 @@
+"""
+Módulo aggregates, mantiene las estadísticas agregadas de cada cuenta.
+
+Los registros de agregados se guardan en la misma tabla, en su propia partición
+(account_id AGGREGATES_PARTITION y el id de la cuenta como username), de modo que se leen todos
+con una sola consulta y no aparecen al recorrer los usuarios. Contienen contadores e histogramas:
+    users, deactivated, deleted: cantidad de usuarios vigentes, inhabilitados y eliminados.
+    access#<mes>: usuarios cuyo último acceso fue ese mes.
+    never_used#<mes>: usuarios sin password ni access key usados, por mes de creación.
+    inactive#<día>: usuarios inhabilitados ese día.
+    key#<mes>: access keys creadas ese mes.
+Al guardar fechas absolutas, la edad de los usuarios y las access keys se calcula al leer,
+recorriendo solo los buckets del registro y no todos los usuarios. Los accesos se agrupan por mes
+para que el registro crezca poco y para que un acceso nuevo dentro del mismo mes no modifique los
+agregados; solo las inhabilitaciones se agrupan por día, porque el plazo de eliminación es de días
+y esos buckets se vacían al eliminar los usuarios. Los buckets que llegan a 0 se quitan del registro
+(ver Users.prune_aggregates).
+
+Uso:
+    python aggregates.py summary [account_id ...]
+    python aggregates.py reconcile [account_id ...]
+"""
+import argparse
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import constants
+import rules
+
+AGGREGATES_PARTITION = "#aggregates"
+COUNTERS = ('users', 'deactivated', 'deleted')
+KEY_AGE_BUCKETS = ((90, '<90'), (180, '90-179'), (365, '180-364'), (None, '>=365'))
+DAY_FORMAT = '%Y-%m-%d'
+MONTH_FORMAT = '%Y-%m'
+
+
+def to_period(value, period_format=MONTH_FORMAT):
+    """
+    Convierte una fecha en formato constants.DATE_FORMAT al periodo que se usa en los histogramas.
+    Args:
+        value (str): fecha guardada en dynamodb.
+        period_format (str): MONTH_FORMAT o DAY_FORMAT.
+    Returns:
+        str: mes YYYY-MM o día YYYY-MM-DD, o None si el valor no es una fecha.
+    """
+    try:
+        return datetime.strptime(value, constants.DATE_FORMAT).strftime(period_format)
+    except (TypeError, ValueError):
+        return None
+
+
+def period_end(period):
+    """
+    Devuelve el último día de un periodo de los histogramas.
+    Args:
+        period (str): mes YYYY-MM o día YYYY-MM-DD.
+    Returns:
+        date: el mismo día, o el último día del mes.
+    """
+    if len(period) > len('YYYY-MM'):
+        return datetime.strptime(period, DAY_FORMAT).date()
+    year, month = map(int, period.split('-'))
+    return date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+
+
+def contribution(item):
+    """
+    Calcula el aporte de un usuario al registro de agregados de su cuenta.
+    Args:
+        item (dict): usuario tal como se guarda en dynamodb, o None.
+    Returns:
+        Counter: atributo del registro de agregados -> cantidad.
+    """
+    result = Counter()
+    if not item:
+        return result
+    if item.get('delete_at'):
+        result['deleted'] += 1
+        return result
+    result['users'] += 1
+    last_access = to_period(item.get('last_access'))
+    created_at = to_period(item.get('created_at'))
+    if last_access:
+        result[f'access#{last_access}'] += 1
+    elif created_at:
+        result[f'never_used#{created_at}'] += 1
+    if item.get('inactive_at'):
+        result['deactivated'] += 1
+        inactive_at = to_period(item['inactive_at'], DAY_FORMAT)
+        if inactive_at:
+            result[f'inactive#{inactive_at}'] += 1
+    for key_created_at in map(to_period, item.get('access_keys') or []):
+        if key_created_at:
+            result[f'key#{key_created_at}'] += 1
+    return result
+
+
+def delta(previous, current):
+    """
+    Calcula el cambio en los agregados cuando un usuario pasa de un estado a otro.
+    Args:
+        previous (dict): usuario antes del cambio, o None si es nuevo.
+        current (dict): usuario después del cambio.
+    Returns:
+        dict: atributo -> incremento, sin los atributos que no cambian.
+    """
+    result = Counter(contribution(current))
+    result.subtract(contribution(previous))
+    return {name: value for name, value in result.items() if value}
+
+
+def build(items):
+    """
+    Reconstruye los agregados de una cuenta a partir de todos sus usuarios.
+    Args:
+        items (iterable): usuarios de la cuenta guardados en dynamodb.
+    Returns:
+        Counter: atributo del registro de agregados -> cantidad.
+    """
+    result = Counter()
+    for item in items:
+        result.update(contribution(item))
+    return result
+
+
+def summarize(record, now=None, inactive_days=constants.INACTIVE_DAYS,
+              days_to_delete=constants.INACTIVE_DAYS_TO_DELETE):
+    """
+    Resume el registro de agregados de una cuenta a la fecha indicada. La edad de los buckets
+    mensuales se mide desde el último día del mes, por lo que inactive y las edades de las access
+    keys son cotas inferiores con resolución de un mes.
+    Args:
+        record (dict): registro de agregados leído de dynamodb.
+        now (datetime): fecha de referencia, por defecto la fecha actual.
+        inactive_days (int): umbral de inactividad.
+        days_to_delete (int): días tras la inhabilitación para eliminar.
+    Returns:
+        dict: users, deactivated, deleted, inactive, pending_deletion y key_ages.
+    """
+    today = (now or datetime.now()).date()
+    summary = {name: int(record.get(name, 0)) for name in COUNTERS}
+    summary.update(inactive=0, pending_deletion=0, key_ages={label: 0 for _, label in KEY_AGE_BUCKETS})
+    for name, value in record.items():
+        if '#' not in name:
+            continue
+        kind, period = name.split('#', 1)
+        age = (today - period_end(period)).days
+        value = int(value)
+        if kind == 'access' and rules.is_zombie(age, age, inactive_days):
+            summary['inactive'] += value
+        elif kind == 'never_used' and rules.is_zombie(None, age, inactive_days):
+            summary['inactive'] += value
+        elif kind == 'inactive' and rules.is_due_for_deletion(age, days_to_delete):
+            summary['pending_deletion'] += value
+        elif kind == 'key':
+            label = next(label for limit, label in KEY_AGE_BUCKETS if limit is None or age < limit)
+            summary['key_ages'][label] += value
+    return summary
+
+
+def format_summary(account_id, summary):
+    """
+    Devuelve el resumen de una cuenta como texto para los logs.
+    """
+    key_ages = ', '.join(f"{label}: {count}" for label, count in summary['key_ages'].items())
+    return (f"Cuenta {account_id}: {summary['users']} usuarios, {summary['inactive']} inactivos, "
+            f"{summary['deactivated']} inhabilitados, {summary['pending_deletion']} pendientes de eliminar, "
+            f"{summary['deleted']} eliminados | edad de access keys (días) {key_ages}")
+
+
+def main():
+    import boto3
+    from dynamodb import Users
+
+    parser = argparse.ArgumentParser(description="Estadísticas agregadas por cuenta.")
+    parser.add_argument('command', choices=('summary', 'reconcile'))
+    parser.add_argument('accounts', nargs='*')
+    args = parser.parse_args()
+
+    users = Users(boto3.resource('dynamodb'))
+    users.exists(constants.TABLE_NAME)
+    if args.command == 'reconcile':
+        accounts = users.reconcile_aggregates(args.accounts)
+        print(f"Agregados reconstruidos para {len(accounts)} cuentas")
+    records = users.get_all_aggregates()
+    for account_id in args.accounts or sorted(records):
+        print(format_summary(account_id, summarize(records.get(account_id, {}))))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,18 @@ Módulo app, este módulo contiene las funciones necesarias para listar, desacti
 y eliminar usuarios de IAM de una o varias cuentas de AWS.
 """
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dynamodb import Users
 import itertools
 
 from user import User
+from flags import flag_enabled
+from profiler import Profiler, profiling_enabled
+from snapshot import write_block
+import aggregates
 import constants
+import rules
 
 iam = boto3.client('iam')
 sts = boto3.client('sts')
@@ -37,15 +43,15 @@ def list_zombie_users():
     """
     expected_days = constants.INACTIVE_DAYS
     result = list()
+    now = datetime.now().replace(tzinfo=None)
     for user in list_users():
         last_access = get_last_access(user)
+        # Dias de inactividad
+        days_since_access = None
         if isinstance(last_access, datetime):
-            difference = (datetime.now().replace(tzinfo=None) - last_access.replace(tzinfo=None)).days
-            # Dias de inactividad
-            if difference >= expected_days:
-                result.append(user)
-        if isinstance(last_access, str) and (
-                datetime.now().replace(tzinfo=None) - user['CreateDate'].replace(tzinfo=None)).days > expected_days:
+            days_since_access = (now - last_access.replace(tzinfo=None)).days
+        days_since_creation = (now - user['CreateDate'].replace(tzinfo=None)).days
+        if rules.is_zombie(days_since_access, days_since_creation, expected_days):
             result.append(user)
     return result
 
@@ -66,8 +72,29 @@ def list_access_keys(username):
     return iam.list_access_keys(UserName=username)
 
 
+# Ultimo uso de access key
+def get_key_last_used(username, access_keys=None):
+    """
+    Devuelve la fecha del último uso de la primera access key del usuario.
+    Args:
+        username (str): El nombre de usuario de IAM.
+        access_keys (dict): respuesta de list_access_keys si ya se consultó.
+    Returns:
+        datetime con el último uso de la access key, o None si no tiene o nunca la usó.
+    """
+    if access_keys is None:
+        access_keys = list_access_keys(username)
+    if access_keys['AccessKeyMetadata']:
+        try:
+            return iam.get_access_key_last_used(
+                AccessKeyId=access_keys['AccessKeyMetadata'][0]['AccessKeyId'])['AccessKeyLastUsed']['LastUsedDate']
+        except:
+            pass
+    return None
+
+
 # Imprimir ultimo acceso
-def get_last_access(user):
+def get_last_access(user, access_keys=None):
     """
     Devuelve la fecha y hora del ultimo acceso de los usuarios de IAM.
     Teniendo en cuanta su último ingreso por acces key o por password,
@@ -75,45 +102,65 @@ def get_last_access(user):
     Args:
         user (dict):un diccionario que representa al usuario de IAM, con los campos 'UserName',
         'PasswordLastUsed' y'CreateDate'.
+        access_keys (dict): respuesta de list_access_keys si ya se consultó.
 
     Returns:
         last_access de tipo datetime o str que es la fecha y hora del último acceso del usuario, o una cadena
         que indica que el usuario no tiene ni password ni access key
     """
-    # Busca las acces keys del usuario
-    access_keys = list_access_keys(user['UserName'])
-    # inicializa las variables que indican si el ultimo acceso fue por password o access key
-    last_access_by_password = False
-    last_access_by_key = False
-    # Inicializa la variable con la fecha de creacion del usuario
-    last_access = None
-    # Busca el ultimo acceso por acces key si hay alguna.
-    if access_keys['AccessKeyMetadata']:
-        try:
-            last_access_by_key = iam.get_access_key_last_used(
-                AccessKeyId=access_keys['AccessKeyMetadata'][0]['AccessKeyId'])['AccessKeyLastUsed']['LastUsedDate']
-        except:
-            pass
-    # Busca el ultimo acceso por password
-    if 'PasswordLastUsed' in user:
-        last_access_by_password = user['PasswordLastUsed']
+    last_access = rules.latest_access(user.get('PasswordLastUsed'), get_key_last_used(user['UserName'], access_keys))
     if last_access is None:
-        last_access = user['CreateDate']
-    # Determinar cual fue el ultimo acceso entre password y el access key
-    if last_access_by_password and last_access_by_key:
-        if last_access_by_password < last_access_by_key:
-            last_access = last_access_by_key
-        else:
-            last_access = last_access_by_password
-    elif last_access_by_password:
-        last_access = last_access_by_password
-    elif last_access_by_key:
-        last_access = last_access_by_key
-    else:
         last_access = "El usuario no tiene password ni access key"
     return last_access
 
 
+def build_user(acct_id, user):
+    """
+    Construye el registro de DynamoDB de un usuario de IAM, consultando su último acceso
+    y la fecha de creación de sus access keys.
+    Args:
+        acct_id (str): id de la cuenta
+        user (dict): diccionario que representa al usuario de IAM.
+    Returns:
+        User: instancia con la información del usuario.
+    """
+    access_keys = list_access_keys(user['UserName'])
+    last_access = get_last_access(user, access_keys)
+    return User(
+        acct_id,
+        user['UserName'],
+        last_access if isinstance(last_access, str) else last_access.strftime(constants.DATE_FORMAT),
+        '',
+        '',
+        user['CreateDate'].strftime(constants.DATE_FORMAT),
+        datetime.now().strftime(constants.DATE_FORMAT),
+        [key['CreateDate'].strftime(constants.DATE_FORMAT) for key in access_keys['AccessKeyMetadata']]
+    )
+
+
+def capture_inventory(acct_id, path, inactive_users):
+    """
+    Agrega al snapshot el inventario de IAM de la cuenta y los datos de último acceso,
+    para poder evaluar las reglas de inactividad sin llamar a AWS (ver módulo snapshot).
+    Args:
+        acct_id (str): id de la cuenta
+        path (str): ruta del archivo de snapshot.
+        inactive_users (list): usuarios inhabilitados registrados en dynamodb.
+    Returns:
+        int: cantidad de usuarios capturados.
+    """
+    inactive_at = {user['username']: datetime.strptime(user['inactive_at'], constants.DATE_FORMAT)
+                   for user in inactive_users if user['account_id'] == acct_id}
+    iam_users = list_users()
+    with ThreadPoolExecutor(max_workers=constants.WORKERS) as executor:
+        keys_last_used = list(executor.map(lambda iam_user: get_key_last_used(iam_user['UserName']), iam_users))
+    return write_block(path, acct_id, [
+        (user['UserName'], user['CreateDate'], user.get('PasswordLastUsed'), key_last_used,
+         inactive_at.get(user['UserName']))
+        for user, key_last_used in zip(iam_users, keys_last_used)
+    ])
+
+
 def delete_password_and_key(username, acct_id):
     """
     Función que se encarga de desactivar los usuarios que reportan determinado tiempo de inactividad en la consola.
@@ -139,7 +186,8 @@ def delete_password_and_key(username, acct_id):
         pass
     try:
         # db.update_users([User(username, '', datetime.now().strftime(date_format), '', '', '')])
-        res = users.update_user(User(acct_id, username, '', datetime.now().strftime(constants.DATE_FORMAT), '', '', ''))
+        res = users.save_user(users.get_user(acct_id, username),
+                              User(acct_id, username, '', datetime.now().strftime(constants.DATE_FORMAT), '', '', ''))
         print(res)
     except:
         print(f"Error al actualizar usuario: {username}")
@@ -161,6 +209,7 @@ def delete_user(username, acct_id):
     Y por último se elimina definitivamente el usuario de IAM.
     Args:
         username (str): El nombre de usuario de IAM a eliminar.
+        acct_id (str): id de la cuenta
     """
     access_keys = list_access_keys(username)
     try:
@@ -186,7 +235,9 @@ def delete_user(username, acct_id):
     # Se elimina finalmente el usuario de IAM
     try:
         print(iam.delete_user(UserName=username))
-        users.update_user(User(acct_id, username, '', '', datetime.now().strftime("%m/%d/%Y, %H:%M:%S"), '', ''))
+        # se vuelve a leer el usuario, la sincronización pudo modificarlo después del scan
+        users.save_user(users.get_user(acct_id, username),
+                        User(acct_id, username, '', '', datetime.now().strftime("%m/%d/%Y, %H:%M:%S"), '', ''))
         print(f"Usuario {username} eliminado")
     except:
         print(f"Error al eliminar el usuario: {username}")
@@ -221,13 +272,22 @@ def lambda_handler(event, context):
             context: objeto que proporciona información sobre el entorno de ejecución de la función.
         Returns:
           una cadena que indica si la función se ejecutó correctamente.
+        Si el evento trae `profile: true` o la variable de entorno IAM_CLEANER_PROFILE está activa,
+        la ejecución se perfila por cuenta y por fase (ver módulo profiler).
+        Con `reconcile: true` (y opcionalmente `accounts`) se reconstruyen los agregados por cuenta.
         """
     # validar instancia de la tabla (requerido)
     print(event)
-    if users.exists(constants.TABLE_NAME):
-        print(f'Tabla {constants.TABLE_NAME} ya existe!')
-    else:
-        users.create_table(constants.TABLE_NAME)
+    profiler = Profiler(profiling_enabled(event))
+    # la tabla la crea el stack con la capacidad del perfil de sizing, no se crea desde aquí
+    if not users.exists(constants.TABLE_NAME):
+        raise RuntimeError(f'La tabla {constants.TABLE_NAME} no existe, debe desplegarse con el stack')
+    print(f'Tabla {constants.TABLE_NAME} ya existe!')
+    if flag_enabled(event, 'reconcile'):
+        # reconstruye los agregados por cuenta a partir de todos los usuarios
+        for account_id in users.reconcile_aggregates(event.get('accounts')):
+            print(aggregates.format_summary(account_id, aggregates.summarize(users.get_aggregates(account_id))))
+        return "Aggregates reconciled successfully..."
     events = {
         'listusersrule': 0,
         'deactiveusersrule': 1,
@@ -240,52 +300,81 @@ def lambda_handler(event, context):
             event_number = events[event]
     print(f'Event: {event} \n Event number: {event_number}', )
     global iam
-    for account in account_ids:
-        session = role_arn_to_session(
-            RoleArn=f'arn:aws:iam::{account}:role/{constants.ASSUME_ROLE}',
-            RoleSessionName=f'lambda_main-cleaner-session-{account}'
-        )
-        iam = session.client('iam')
-        sts = session.client('sts')
-        account_id = sts.get_caller_identity().get('Account')
-        user_list = []
-        users_to_delete = users.get_inactive_users()
-        if event_number >= 0:
-            for user in list_users():
-                user_list.append(User(
-                    account_id,
-                    user['UserName'],
-                    get_last_access(user) if isinstance(get_last_access(user), str) else get_last_access(user).strftime(
-                        constants.DATE_FORMAT),
-                    '',
-                    '',
-                    user['CreateDate'].strftime(constants.DATE_FORMAT),
-                    datetime.now().strftime(constants.DATE_FORMAT)
-                ))
-            # [test] crear o actualizar usuarios en dynamodb
-            for user in user_list:
-                user_exists = users.user_exists(user.account_id, user.username)
-                if user_exists:
-                    print(f"{user.username} existe!")
-                    users.update_user(user)
-                else:
-                    users.add_user(user)
-                    print(f"{user.username} creado!")
-        if event_number == 1:
-            # [staging] inhabilitar access keys y eliminar password
-            [delete_password_and_key(z_user['UserName'], account_id) for z_user in list_zombie_users()]
-        if event_number == 2:
-            # [prod] elimina usuarios inactivos en dynamodb
-            for user in users_to_delete:
-                difference = datetime.now().replace(tzinfo=None) - datetime.strptime(user['inactive_at'],
-                                                                                     constants.DATE_FORMAT).replace(
-                    tzinfo=None)
-                if difference.days >= constants.INACTIVE_DAYS_TO_DELETE:
-                    print(f"Eliminando {user['username']}")
-                    try:
-                        delete_user(user['username'], account_id)
-                    except:
-                        print(f"Error eliminating {user['username']}")
+    processed_accounts = []
+    try:
+        for account in account_ids:
+            with profiler.phase(account, 'session'):
+                session = role_arn_to_session(
+                    RoleArn=f'arn:aws:iam::{account}:role/{constants.ASSUME_ROLE}',
+                    RoleSessionName=f'lambda_main-cleaner-session-{account}'
+                )
+                iam = session.client('iam')
+                sts = session.client('sts')
+                account_id = sts.get_caller_identity().get('Account')
+            processed_accounts.append(account_id)
+            # las cuentas con usuarios previos a los agregados no tienen registro, se construye una vez
+            if users.ensure_aggregates(account_id):
+                print(f"Agregados de la cuenta {account_id} construidos")
+            with profiler.phase(account, 'scan'):
+                users_to_delete = users.get_inactive_users()
+            if event_number >= 0:
+                with profiler.phase(account, 'sync'):
+                    # consulta el ultimo acceso de los usuarios en paralelo; al perfilar se consulta
+                    # en el hilo principal, incluso un executor de un hilo quedaría fuera de cProfile
+                    if profiler.max_workers() > 1:
+                        with ThreadPoolExecutor(max_workers=profiler.max_workers()) as executor:
+                            user_list = list(executor.map(lambda iam_user: build_user(account_id, iam_user),
+                                                          list_users()))
+                    else:
+                        user_list = [build_user(account_id, iam_user) for iam_user in list_users()]
+                    # [test] crear o actualizar usuarios en dynamodb por lotes; un error deja al usuario
+                    # o al lote sin sincronizar hasta la siguiente ejecución, sin detener la cuenta
+                    for start in range(0, len(user_list), constants.BATCH_SIZE):
+                        batch = user_list[start:start + constants.BATCH_SIZE]
+                        try:
+                            existing = users.get_users(account_id, [user.username for user in batch])
+                        except Exception:
+                            print(f"Error leyendo el lote {start // constants.BATCH_SIZE} de {account_id}")
+                            continue
+                        new_users = []
+                        for user in batch:
+                            if user.username in existing:
+                                print(f"{user.username} existe!")
+                                try:
+                                    users.save_user(existing[user.username], user)
+                                except Exception:
+                                    print(f"Error actualizando {user.username}")
+                            else:
+                                new_users.append(user)
+                        try:
+                            users.add_users(new_users)
+                            [print(f"{user.username} creado!") for user in new_users]
+                        except Exception:
+                            print(f"Error creando {len(new_users)} usuarios de {account_id}")
+            if event_number == 1:
+                # [staging] inhabilitar access keys y eliminar password
+                with profiler.phase(account, 'deactivate'):
+                    [delete_password_and_key(z_user['UserName'], account_id) for z_user in list_zombie_users()]
+            if event_number == 2:
+                # [prod] elimina usuarios inactivos en dynamodb
+                with profiler.phase(account, 'delete'):
+                    for user in users_to_delete:
+                        difference = datetime.now().replace(tzinfo=None) - datetime.strptime(user['inactive_at'],
+                                                                                             constants.DATE_FORMAT).replace(
+                            tzinfo=None)
+                        if rules.is_due_for_deletion(difference.days):
+                            print(f"Eliminando {user['username']}")
+                            try:
+                                delete_user(user['username'], account_id)
+                            except:
+                                print(f"Error eliminating {user['username']}")
+    finally:
+        # el reporte también detiene tracemalloc si alguna fase falla
+        profiler.report()
+    # resumen de la ejecución a partir de los agregados de cada cuenta, quitando los buckets en 0
+    for account_id in processed_accounts:
+        record = users.prune_aggregates(account_id, users.get_aggregates(account_id))
+        print(aggregates.format_summary(account_id, aggregates.summarize(record)))
 
     return "Lambda executed successfully..."
 
@@ -4,11 +4,25 @@ Módulo constants: define las constantes utilizadas en la función Lambda.
 DATE_FORMAT: formato de fecha utilizado en la función.
 INACTIVE_DAYS: cantidad de días para que un usuario sea considerado inactivo.
 INACTIVE_DAYS_TO_DELETE: cantidad de días para que un usuario inactivo sea eliminado.
+PROFILE_ENV_VAR: variable de entorno que habilita el perfilado de la ejecución.
+PROFILE_TOP: cantidad de funciones y sitios de memoria a reportar por fase.
+PROFILE_DIR: directorio donde se guardan los reportes de perfilado.
+WORKERS: hilos para consultar IAM en paralelo, definido por el perfil de dimensionamiento del stack.
+BATCH_SIZE: usuarios por lote en las lecturas y escrituras de DynamoDB (máximo 100).
 """
+import os
+
 TABLE_NAME = "users_test"
 DATE_FORMAT = "%m/%d/%Y, %H:%M:%S"
 INACTIVE_DAYS = 30
 INACTIVE_DAYS_TO_DELETE = 7
 ASSUME_ROLE = "iam-list-user-role-tem"
+PROFILE_ENV_VAR = "IAM_CLEANER_PROFILE"
+PROFILE_TOP = 10
+PROFILE_DIR = "/tmp"
+WORKERS_ENV_VAR = "IAM_CLEANER_WORKERS"
+BATCH_SIZE_ENV_VAR = "IAM_CLEANER_BATCH_SIZE"
+WORKERS = max(1, int(os.environ.get(WORKERS_ENV_VAR, 1)))
+BATCH_SIZE = min(100, max(1, int(os.environ.get(BATCH_SIZE_ENV_VAR, 25))))
 
 # boto3.client('sts').get_caller_identity().get('Account')
\ No newline at end of file
@@ -1,12 +1,133 @@
 import datetime
 import logging
+import time
+from collections import defaultdict
 
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
 from botocore.exceptions import ClientError
 
+import aggregates
+
 logger = logging.getLogger(__name__)
 
 date_format = "%m/%d/%Y, %H:%M:%S"
+# New users per transaction. DynamoDB accepts up to 100 items, smaller chunks keep each
+# transaction within the capacity of a small provisioned table.
+TRANSACT_CHUNK = 10
+# Exponential backoff for throttled or unprocessed requests, in seconds. With 8 attempts a
+# request keeps retrying for about 6 seconds before giving up.
+BACKOFF_BASE = 0.05
+BACKOFF_MAX = 5
+MAX_ATTEMPTS = 8
+RETRYABLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+                    'TransactionConflictException', 'InternalServerError')
+RETRYABLE_CANCELLATIONS = ('ProvisionedThroughputExceeded', 'ThrottlingError', 'RequestLimitExceeded',
+                           'TransactionConflict')
+# Fields of a user item that determine its contribution to the aggregates.
+AGGREGATED_FIELDS = ('last_access', 'created_at', 'inactive_at', 'delete_at', 'access_keys')
+serializer = TypeSerializer()
+
+
+def backoff(attempt):
+    """
+    Sleep before retrying a request, doubling the wait on every attempt.
+    :param attempt: number of retries already done, starting at 0.
+    """
+    time.sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def cancellation_codes(err):
+    """
+    Get the reasons of a cancelled transaction, ignoring the items that did not fail.
+    """
+    return [reason.get('Code') for reason in err.response.get('CancellationReasons', [])
+            if reason.get('Code') not in (None, 'None')]
+
+
+def is_stale(err):
+    """
+    Determines whether a write failed because the item no longer has the state it was read with.
+    """
+    code = err.response['Error']['Code']
+    return code == 'ConditionalCheckFailedException' or (
+        code == 'TransactionCanceledException' and 'ConditionalCheckFailed' in cancellation_codes(err))
+
+
+def is_retryable(err):
+    """
+    Determines whether a request failed because of throttling or a conflict and can be sent again as is.
+    """
+    code = err.response['Error']['Code']
+    if code == 'TransactionCanceledException':
+        reasons = cancellation_codes(err)
+        return bool(reasons) and all(reason in RETRYABLE_CANCELLATIONS for reason in reasons)
+    return code in RETRYABLE_ERRORS
+
+
+def with_retries(call, **kwargs):
+    """
+    Call a DynamoDB operation, retrying with backoff while it is throttled.
+    :param call: the boto3 operation.
+    :param kwargs: arguments of the operation.
+    :return: the response of the operation; otherwise, raise the last error.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return call(**kwargs)
+        except ClientError as err:
+            if not is_retryable(err) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            backoff(attempt)
+
+
+def state_condition(previous):
+    """
+    Build a condition that only holds while the user item still has the state of previous,
+    so an aggregates delta is never applied to a different state than the one it was computed from.
+    :param previous: user item as read from table, or None if it was not in table.
+    :return: condition expression, attribute names and attribute values.
+    """
+    if previous is None:
+        return 'attribute_not_exists(username)', {}, {}
+    conditions = []
+    names = {}
+    values = {}
+    for index, field in enumerate(AGGREGATED_FIELDS):
+        names[f'#p{index}'] = field
+        if field in previous:
+            conditions.append(f'#p{index} = :p{index}')
+            values[f':p{index}'] = previous[field]
+        else:
+            conditions.append(f'attribute_not_exists(#p{index})')
+    return ' AND '.join(conditions), names, values
+
+
+def user_item(user):
+    """
+    Build the table item of a user.
+    :param user: A object of User class.
+    :return: dict with the attributes of the user.
+    """
+    item = {
+        'account_id': user.account_id,
+        'username': user.username,
+        'last_access': user.last_access,
+        'inactive_at': user.inactive_at,
+        'delete_at': user.delete_at,
+        'created_at': user.created_at,
+        'updated_at': user.updated_at
+    }
+    if user.access_keys is not None:
+        item['access_keys'] = user.access_keys
+    return item
+
+
+def serialize(values):
+    """
+    Convert a dict of python values to DynamoDB attribute values for the low-level client.
+    """
+    return {name: serializer.serialize(value) for name, value in values.items()}
 
 
 class Users:
@@ -69,6 +190,38 @@ class Users:
                 err.response['Error']['Code'], err.response['Error']['Message'])
             raise
 
+    def add_users(self, users):
+        """
+        Add several new users to table, updating the aggregates of their accounts in the
+        same transactions. If a user was added meanwhile, its chunk is saved user by user.
+        :param users: A list of objects of User class.
+        :return: None if added; otherwise, raise a error.
+        """
+        by_account = defaultdict(list)
+        for user in users:
+            by_account[user.account_id].append(user)
+        try:
+            for account_id, account_users in by_account.items():
+                for start in range(0, len(account_users), TRANSACT_CHUNK):
+                    chunk = account_users[start:start + TRANSACT_CHUNK]
+                    items = [user_item(user) for user in chunk]
+                    try:
+                        self._transact([{'Put': {
+                            'TableName': self.table.name,
+                            'Item': serialize(item),
+                            'ConditionExpression': 'attribute_not_exists(username)'
+                        }} for item in items], account_id, aggregates.build(items))
+                    except ClientError as err:
+                        if not is_stale(err):
+                            raise
+                        for user in chunk:
+                            self.save_user(self.get_user(account_id, user.username), user)
+        except ClientError as err:
+            logger.error(
+                "Couldn't add users to table %s. Here's why: %s: %s", self.table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+
     def exists(self, table_name):
         """
         Determines whether a table exists. As a side effect, stores the table in
@@ -95,7 +248,7 @@ class Users:
 
     def scan_users(self, args={}):
         """
-        Get all users in table.
+        Get all users in table, without the aggregates records.
         :param args: Dict with filters.
         :return: users in table; otherwise, raise a error.
         """
@@ -111,7 +264,8 @@ class Users:
                 if start_key:
                     scan_kwargs['ExclusiveStartKey'] = start_key
                 response = self.table.scan(**scan_kwargs)
-                users.extend(response.get('Items', []))
+                users.extend(item for item in response.get('Items', [])
+                             if item.get('account_id') != aggregates.AGGREGATES_PARTITION)
                 start_key = response.get('LastEvaluatedKey', None)
                 done = start_key is None
         except ClientError as err:
@@ -195,3 +349,254 @@ class Users:
                 err.response['Error']['Code'], err.response['Error']['Message'])
         else:
             return response
+
+    def get_user(self, account_id, username):
+        """
+        Get a user from table with a strongly consistent read.
+        :param account_id: id of aws account where user owns.
+        :param username: username of user to get.
+        :return: user item if found, None otherwise; raise a error if the read fails.
+        """
+        try:
+            response = self.table.get_item(Key={'account_id': account_id, 'username': username},
+                                           ConsistentRead=True)
+        except ClientError as err:
+            logger.error(
+                "Couldn't get user %s from table %s. Here's why: %s: %s", username, self.table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        return response.get('Item')
+
+    def get_users(self, account_id, usernames):
+        """
+        Get the users of a batch that already exist in table, with strongly consistent reads.
+        :param account_id: id of aws account where users owns.
+        :param usernames: list of usernames to search, at most 100 per call.
+        :return: dict of username to user item; otherwise, raise a error, also when some keys are
+            still unprocessed after MAX_ATTEMPTS reads.
+        """
+        existing = {}
+        request = {self.table.name: {
+            'Keys': [{'account_id': account_id, 'username': username} for username in usernames],
+            'ConsistentRead': True
+        }}
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                response = self.dyn_resource.batch_get_item(RequestItems=request)
+                existing.update((item['username'], item) for item in response['Responses'].get(self.table.name, []))
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    return existing
+                if attempt < MAX_ATTEMPTS - 1:
+                    backoff(attempt)
+        except ClientError as err:
+            logger.error(
+                "Couldn't get users from table %s. Here's why: %s: %s", self.table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        unprocessed = len(request[self.table.name]['Keys'])
+        logger.error("Couldn't get %s users from table %s after %s attempts.",
+                     unprocessed, self.table.name, MAX_ATTEMPTS)
+        raise RuntimeError(f"{unprocessed} users of account {account_id} still unprocessed after "
+                           f"{MAX_ATTEMPTS} attempts")
+
+    def save_user(self, previous, user):
+        """
+        Update a user in table and, in the same transaction, the aggregates of its account.
+        The write only succeeds while the user still has the state of previous; otherwise the
+        user is read again and the write retried.
+        :param previous: user item before the change, or None if it is not in table.
+        :param user: A object of User class with the fields to update.
+        :return: user item after the change; otherwise, raise a error.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return self._write_user(previous, user)
+            except ClientError as err:
+                if not is_stale(err) or attempt == MAX_ATTEMPTS - 1:
+                    logger.error(
+                        "Couldn't save user %s in table %s. Here's why: %s: %s", user.username, self.table.name,
+                        err.response['Error']['Code'], err.response['Error']['Message'])
+                    raise
+                previous = self.get_user(user.account_id, user.username)
+
+    def _write_user(self, previous, user):
+        """
+        Write a user conditioned on its previous state, as described in save_user.
+        A new user is written with all its fields; an existing one only with the non empty
+        fields of user, as in update_user.
+        """
+        if previous is None:
+            values = {name: value for name, value in user_item(user).items()
+                      if name not in ('account_id', 'username')}
+        else:
+            values = {}
+            if user.last_access != '':
+                values.update(last_access=user.last_access, created_at=user.created_at)
+            if user.inactive_at != '':
+                values['inactive_at'] = user.inactive_at
+            if user.delete_at != '':
+                values['delete_at'] = user.delete_at
+            if user.access_keys is not None:
+                values['access_keys'] = user.access_keys
+        values['updated_at'] = datetime.datetime.now().strftime(date_format)
+        current = dict(previous or {'account_id': user.account_id, 'username': user.username}, **values)
+        condition, names, condition_values = state_condition(previous)
+        update = {
+            'Key': {'account_id': user.account_id, 'username': user.username},
+            'UpdateExpression': 'set ' + ', '.join(f'{name}=:{name}' for name in values),
+            'ConditionExpression': condition,
+            'ExpressionAttributeValues': dict({f':{name}': value for name, value in values.items()},
+                                              **condition_values)
+        }
+        if names:
+            update['ExpressionAttributeNames'] = names
+        changes = aggregates.delta(previous, current)
+        if changes:
+            self._transact([{'Update': dict(update, TableName=self.table.name, Key=serialize(update['Key']),
+                                            ExpressionAttributeValues=serialize(
+                                                update['ExpressionAttributeValues']))}],
+                           user.account_id, changes)
+        else:
+            with_retries(self.table.update_item, **update)
+        return current
+
+    def _transact(self, writes, account_id, changes):
+        """
+        Run writes and the increments of the account aggregates in a single transaction,
+        retrying with backoff while it is throttled.
+        :param writes: list of low-level transaction items, at most 99.
+        :param account_id: id of aws account of the aggregates.
+        :param changes: dict of aggregate attribute to increment.
+        """
+        if changes:
+            names = {f'#a{index}': name for index, name in enumerate(changes)}
+            writes = writes + [{'Update': {
+                'TableName': self.table.name,
+                'Key': serialize({'account_id': aggregates.AGGREGATES_PARTITION, 'username': account_id}),
+                'UpdateExpression': 'ADD ' + ', '.join(f'{name} :a{index}' for index, name in enumerate(names)),
+                'ExpressionAttributeNames': names,
+                'ExpressionAttributeValues': serialize(
+                    {f':a{index}': value for index, value in enumerate(changes.values())})
+            }}]
+        with_retries(self.dyn_resource.meta.client.transact_write_items, TransactItems=writes)
+
+    def get_aggregates(self, account_id):
+        """
+        Get the aggregates record of an account.
+        :param account_id: id of aws account.
+        :return: aggregates record, empty if the account has none.
+        """
+        return self.get_user(aggregates.AGGREGATES_PARTITION, account_id) or {}
+
+    def get_all_aggregates(self):
+        """
+        Get the aggregates records of every account, reading only the aggregates partition.
+        :return: dict of account id to aggregates record; otherwise, raise a error.
+        """
+        records = {}
+        query_kwargs = {'KeyConditionExpression': Key('account_id').eq(aggregates.AGGREGATES_PARTITION)}
+        try:
+            while True:
+                response = self.table.query(**query_kwargs)
+                records.update((item['username'], item) for item in response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except ClientError as err:
+            logger.error(
+                "Couldn't query aggregates in table %s. Here's why: %s: %s", self.table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        return records
+
+    def query_users(self, account_id):
+        """
+        Get all users of an account, reading only its partition.
+        :param account_id: id of aws account.
+        :return: users of the account; otherwise, raise a error.
+        """
+        users = []
+        query_kwargs = {'KeyConditionExpression': Key('account_id').eq(account_id)}
+        try:
+            while True:
+                response = self.table.query(**query_kwargs)
+                users.extend(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except ClientError as err:
+            logger.error(
+                "Couldn't query users of account %s in table %s. Here's why: %s: %s", account_id,
+                self.table.name, err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        return users
+
+    def reconcile_aggregates(self, account_ids=None):
+        """
+        Rebuild the aggregates records from the users in table. The given accounts are read
+        with a query on their partitions, all accounts with a full scan.
+        :param account_ids: accounts to rebuild; all accounts in table if empty.
+        :return: list of rebuilt account ids; otherwise, raise a error.
+        """
+        if account_ids:
+            by_account = {account_id: self.query_users(account_id) for account_id in account_ids}
+        else:
+            by_account = defaultdict(list)
+            for item in self.scan_users({}):
+                by_account[item['account_id']].append(item)
+        try:
+            for account_id, items in by_account.items():
+                with_retries(self.table.put_item, Item={
+                    'account_id': aggregates.AGGREGATES_PARTITION,
+                    'username': account_id,
+                    **aggregates.build(items)
+                })
+        except ClientError as err:
+            logger.error(
+                "Couldn't rebuild aggregates in table %s. Here's why: %s: %s", self.table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        return list(by_account)
+
+    def ensure_aggregates(self, account_id):
+        """
+        Build the aggregates record of an account that has none yet, for example because its
+        users were added before the aggregates existed. Otherwise the increments of the sync
+        would be applied over an empty record.
+        :param account_id: id of aws account.
+        :return: True if the record was built; otherwise, False.
+        """
+        if self.get_aggregates(account_id):
+            return False
+        self.reconcile_aggregates([account_id])
+        return True
+
+    def prune_aggregates(self, account_id, record):
+        """
+        Remove the buckets of an aggregates record that reached 0, so the item does not grow
+        with every month or day that ever had a user. The removal is conditioned on the buckets
+        still being 0; if a concurrent write changed them they are left for the next run.
+        :param account_id: id of aws account.
+        :param record: aggregates record as read from table.
+        :return: record without the removed buckets.
+        """
+        empty = [name for name, value in record.items() if '#' in name and value == 0]
+        if not empty:
+            return record
+        names = {f'#a{index}': name for index, name in enumerate(empty)}
+        try:
+            with_retries(self.table.update_item,
+                         Key={'account_id': aggregates.AGGREGATES_PARTITION, 'username': account_id},
+                         UpdateExpression='REMOVE ' + ', '.join(names),
+                         ConditionExpression=' AND '.join(f'{name} = :zero' for name in names),
+                         ExpressionAttributeNames=names,
+                         ExpressionAttributeValues={':zero': 0})
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(
+                    "Couldn't prune aggregates of account %s in table %s. Here's why: %s: %s", account_id,
+                    self.table.name, err.response['Error']['Code'], err.response['Error']['Message'])
+                raise
+            return record
+        return {name: value for name, value in record.items() if name not in empty}
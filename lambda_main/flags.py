@@ -0,0 +1,21 @@
+"""
+Módulo flags, interpreta las banderas que habilitan funciones opcionales en una ejecución.
+"""
+import os
+
+
+def flag_enabled(event, key, env_var=None):
+    """
+    Determina si una bandera está activa, ya sea por un campo del evento o por una variable de entorno.
+    El campo del evento tiene prioridad sobre la variable de entorno.
+    Args:
+        event (dict): evento recibido por la función Lambda.
+        key (str): nombre del campo del evento.
+        env_var (str): nombre de la variable de entorno, o None si la bandera solo llega en el evento.
+    Returns:
+        bool: True si la bandera está activa.
+    """
+    flag = event.get(key) if isinstance(event, dict) else None
+    if flag is None and env_var:
+        flag = os.environ.get(env_var, '')
+    return str(flag).strip().lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,120 @@
+"""
+Módulo profiler, permite perfilar bajo demanda una ejecución de la función Lambda.
+Cuando está habilitado, cada fase de cada cuenta se ejecuta bajo cProfile y tracemalloc
+y al final se genera un reporte con las funciones que más CPU consumen y los
+sitios que más memoria reservan. Cuando está deshabilitado no agrega trabajo.
+"""
+import cProfile
+import io
+import os
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import constants
+from flags import flag_enabled
+
+
+def profiling_enabled(event):
+    """
+    Determina si la ejecución debe perfilarse, ya sea por el campo `profile` del evento
+    o por la variable de entorno definida en constants.PROFILE_ENV_VAR.
+    Args:
+        event (dict): evento recibido por la función Lambda.
+    Returns:
+        bool: True si se debe perfilar la ejecución.
+    """
+    return flag_enabled(event, 'profile', constants.PROFILE_ENV_VAR)
+
+
+class Profiler:
+    """
+    La clase Profiler agrupa las mediciones de CPU y memoria por cuenta y por fase.
+    """
+
+    def __init__(self, enabled, top=constants.PROFILE_TOP):
+        """
+        Crea una instancia de la clase Profiler.
+        Args:
+            enabled (bool): indica si se deben tomar mediciones.
+            top (int): cantidad de funciones y sitios de memoria a reportar por fase.
+        """
+        self.enabled = enabled
+        self.top = top
+        self.results = []
+
+    def max_workers(self, workers=constants.WORKERS):
+        """
+        Cantidad de hilos a usar dentro de una fase. cProfile solo mide el hilo que lo activa,
+        por lo que al perfilar las fases se ejecutan en serie para que el trabajo de los hilos
+        aparezca en el reporte; los tiempos medidos corresponden a una ejecución sin paralelismo.
+        Args:
+            workers (int): cantidad de hilos configurada.
+        Returns:
+            int: 1 si el perfilado está habilitado, workers en otro caso.
+        """
+        return 1 if self.enabled else workers
+
+    @contextmanager
+    def phase(self, account_id, name):
+        """
+        Mide el bloque de código que envuelve como una fase de la cuenta indicada.
+        Las fases no deben anidarse, cProfile solo admite un perfilador activo.
+        Args:
+            account_id (str): cuenta que se está procesando, la misma llave para todas sus fases.
+            name (str): nombre de la fase (sync, deactivate, delete...).
+        """
+        if not self.enabled:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        started = datetime.now()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = (datetime.now() - started).total_seconds()
+            after = tracemalloc.take_snapshot()
+            self.results.append((account_id, name, elapsed, profile,
+                                 after.compare_to(before, 'lineno')[:self.top]))
+
+    def report(self):
+        """
+        Genera el reporte de la ejecución, lo imprime en los logs y lo guarda en
+        constants.PROFILE_DIR.
+        Returns:
+            str: ruta del archivo generado, o None si el perfilado está deshabilitado.
+        """
+        if not self.enabled:
+            return None
+        lines = []
+        try:
+            for account_id, name, elapsed, profile, memory_stats in self.results:
+                lines.append(f"== Cuenta: {account_id} | Fase: {name} | {elapsed:.3f}s ==")
+                lines.append("-- CPU (cumulative) --")
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(self.top)
+                lines.extend(line for line in stream.getvalue().splitlines() if line.strip())
+                lines.append("-- Memoria (size diff) --")
+                for stat in memory_stats:
+                    lines.append(str(stat))
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                lines.append(f"== Memoria actual: {current / 1024:.1f} KiB | pico: {peak / 1024:.1f} KiB ==")
+        finally:
+            # en un contenedor reutilizado, tracemalloc seguiría activo en las siguientes invocaciones
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        report = "\n".join(lines)
+        print(report)
+        path = os.path.join(constants.PROFILE_DIR,
+                            f"profile-{datetime.now().strftime('%Y%m%d%H%M%S')}.txt")
+        with open(path, 'w') as file:
+            file.write(report)
+        print(f"Reporte de perfilado guardado en {path}")
+        return path
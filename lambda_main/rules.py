@@ -0,0 +1,47 @@
+"""
+Módulo rules, contiene las reglas que deciden si un usuario de IAM se inhabilita o se elimina.
+Las reglas trabajan con días transcurridos para que las compartan la ejecución contra las
+cuentas de AWS y la reproducción de snapshots (ver módulo snapshot).
+"""
+import constants
+
+
+def latest_access(password_last_used, key_last_used):
+    """
+    Devuelve el acceso más reciente entre el password y la access key.
+    Args:
+        password_last_used: fecha del último uso del password, o None.
+        key_last_used: fecha del último uso de la access key, o None.
+    Returns:
+        El valor más reciente de los dos, o None si el usuario no utilizó ninguno.
+    """
+    if password_last_used and key_last_used:
+        return key_last_used if password_last_used < key_last_used else password_last_used
+    return password_last_used or key_last_used or None
+
+
+def is_zombie(days_since_access, days_since_creation, inactive_days=constants.INACTIVE_DAYS):
+    """
+    Determina si un usuario se considera inactivo.
+    Args:
+        days_since_access (int): días desde el último acceso, o None si nunca usó password ni access key.
+        days_since_creation (int): días desde la creación del usuario.
+        inactive_days (int): umbral de inactividad.
+    Returns:
+        bool: True si el usuario debe inhabilitarse.
+    """
+    if days_since_access is None:
+        return days_since_creation > inactive_days
+    return days_since_access >= inactive_days
+
+
+def is_due_for_deletion(days_since_inactive, days_to_delete=constants.INACTIVE_DAYS_TO_DELETE):
+    """
+    Determina si un usuario inhabilitado debe eliminarse.
+    Args:
+        days_since_inactive (int): días desde que el usuario fue inhabilitado.
+        days_to_delete (int): días que se espera antes de eliminarlo.
+    Returns:
+        bool: True si el usuario debe eliminarse.
+    """
+    return days_since_inactive >= days_to_delete
@@ -0,0 +1,203 @@
+"""
+Módulo snapshot, permite capturar el inventario de IAM de las cuentas en un archivo
+compacto y reproducirlo sin hacer llamadas a AWS, para evaluar el efecto de cambiar
+INACTIVE_DAYS o INACTIVE_DAYS_TO_DELETE.
+
+El archivo solo admite agregar datos. Cada captura agrega un bloque por cuenta:
+    cabecera:  account_id (12 bytes), captured_at, cantidad de registros, tamaño en bytes
+    registros: created_at, password_last_used, key_last_used, inactive_at, largo y username
+Las fechas se guardan como segundos epoch UTC, 0 indica que no hay valor.
+Al reproducir se usa el bloque más reciente de cada cuenta. Si la última captura quedó incompleta
+(por ejemplo, el proceso terminó a mitad de la escritura) ese bloque se descarta.
+
+Uso:
+    python snapshot.py capture <archivo> [account_id ...]
+    python snapshot.py replay <archivo> [--inactive-days N] [--days-to-delete N] [--now FECHA] [--list]
+"""
+import argparse
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+
+import constants
+import rules
+
+MAGIC = b'IAMSNAP1'
+BLOCK = struct.Struct('<12sqII')
+RECORD = struct.Struct('<qqqqB')
+SECONDS_PER_DAY = 86400
+
+
+def to_epoch(value):
+    """
+    Convierte una fecha a segundos epoch, las fechas sin zona horaria se asumen en UTC.
+    Args:
+        value (datetime): fecha a convertir, o None.
+    Returns:
+        int: segundos epoch, o 0 si no hay fecha.
+    """
+    if value is None:
+        return 0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def write_block(path, account_id, records, captured_at=None):
+    """
+    Agrega al snapshot el inventario de una cuenta.
+    Args:
+        path (str): ruta del archivo de snapshot, se crea si no existe.
+        account_id (str): id de la cuenta.
+        records (iterable): tuplas (username, created_at, password_last_used, key_last_used, inactive_at).
+        captured_at (datetime): fecha de la captura, por defecto la fecha actual.
+    Returns:
+        int: cantidad de usuarios escritos.
+    """
+    body = bytearray()
+    count = 0
+    for username, created_at, password_last_used, key_last_used, inactive_at in records:
+        name = username.encode('utf-8')
+        body += RECORD.pack(to_epoch(created_at), to_epoch(password_last_used), to_epoch(key_last_used),
+                            to_epoch(inactive_at), len(name))
+        body += name
+        count += 1
+    captured_at = to_epoch(captured_at or datetime.now(timezone.utc))
+    with open(path, 'ab') as file:
+        if file.tell() == 0:
+            file.write(MAGIC)
+        file.write(BLOCK.pack(account_id.encode('ascii'), captured_at, count, len(body)) + body)
+    return count
+
+
+def latest_blocks(buffer):
+    """
+    Recorre las cabeceras del snapshot y devuelve el bloque más reciente de cada cuenta.
+    Un bloque final incompleto se descarta con un aviso.
+    Args:
+        buffer: contenido del snapshot (bytes o mmap).
+    Returns:
+        dict: account_id -> (captured_at, count, offset de los registros, offset del final del bloque).
+    """
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError("El archivo no es un snapshot de inventario de IAM")
+    blocks = {}
+    offset = len(MAGIC)
+    while offset < len(buffer):
+        if offset + BLOCK.size > len(buffer):
+            print(f"Aviso: cabecera incompleta en el byte {offset}, se descarta el final del snapshot")
+            break
+        account_id, captured_at, count, size = BLOCK.unpack_from(buffer, offset)
+        start = offset + BLOCK.size
+        if start + size > len(buffer):
+            print(f"Aviso: bloque incompleto en el byte {offset}, se descarta el final del snapshot")
+            break
+        account_id = account_id.rstrip(b'\0').decode('ascii')
+        if account_id not in blocks or captured_at >= blocks[account_id][0]:
+            blocks[account_id] = (captured_at, count, start, start + size)
+        offset = start + size
+    return blocks
+
+
+def replay(path, inactive_days=constants.INACTIVE_DAYS, days_to_delete=constants.INACTIVE_DAYS_TO_DELETE,
+           now=None):
+    """
+    Aplica las reglas de inactividad y eliminación sobre el snapshot, sin llamar a AWS.
+    Los usuarios inactivos que aún no fueron inhabilitados se reportan para inhabilitar, y los ya
+    inhabilitados se reportan para eliminar cuando cumplen el plazo.
+    Args:
+        path (str): ruta del archivo de snapshot.
+        inactive_days (int): umbral de inactividad a evaluar.
+        days_to_delete (int): días tras la inhabilitación para eliminar a evaluar.
+        now (datetime): fecha de referencia, por defecto la fecha de captura de cada cuenta.
+    Returns:
+        dict: account_id -> {'users': int, 'deactivate': [usernames], 'delete': [usernames]};
+        vacío si el archivo está vacío.
+    """
+    result = {}
+    if os.path.getsize(path) == 0:
+        return result
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        unpack_from = RECORD.unpack_from
+        record_size = RECORD.size
+        is_zombie = rules.is_zombie
+        is_due_for_deletion = rules.is_due_for_deletion
+        for account_id, (captured_at, count, offset, end) in latest_blocks(buffer).items():
+            reference = to_epoch(now) if now else captured_at
+            deactivate = []
+            delete = []
+            for _ in range(count):
+                created_at, password_last_used, key_last_used, inactive_at, size = unpack_from(buffer, offset)
+                offset += record_size
+                if inactive_at:
+                    if is_due_for_deletion((reference - inactive_at) // SECONDS_PER_DAY, days_to_delete):
+                        delete.append(buffer[offset:offset + size].decode('utf-8'))
+                else:
+                    last_access = max(password_last_used, key_last_used)
+                    days_since_access = (reference - last_access) // SECONDS_PER_DAY if last_access else None
+                    if is_zombie(days_since_access, (reference - created_at) // SECONDS_PER_DAY, inactive_days):
+                        deactivate.append(buffer[offset:offset + size].decode('utf-8'))
+                offset += size
+            if offset != end:
+                raise ValueError(f"El bloque de la cuenta {account_id} está corrupto")
+            result[account_id] = {'users': count, 'deactivate': deactivate, 'delete': delete}
+    return result
+
+
+def capture(path, accounts):
+    """
+    Captura el inventario de las cuentas indicadas usando las credenciales locales.
+    Args:
+        path (str): ruta del archivo de snapshot.
+        accounts (list): ids de las cuentas; si está vacía se captura la cuenta de las credenciales.
+    """
+    import app
+    app.users.exists(constants.TABLE_NAME)
+    inactive_users = app.users.get_inactive_users()
+    for account in accounts or [None]:
+        if account:
+            session = app.role_arn_to_session(
+                RoleArn=f'arn:aws:iam::{account}:role/{constants.ASSUME_ROLE}',
+                RoleSessionName=f'lambda_main-snapshot-session-{account}'
+            )
+            app.iam = session.client('iam')
+            account_id = session.client('sts').get_caller_identity().get('Account')
+        else:
+            account_id = app.sts.get_caller_identity().get('Account')
+        count = app.capture_inventory(account_id, path, inactive_users)
+        print(f"Cuenta {account_id}: {count} usuarios capturados en {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Captura y reproducción del inventario de IAM.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    capture_parser = commands.add_parser('capture', help="captura el inventario de las cuentas")
+    capture_parser.add_argument('path')
+    capture_parser.add_argument('accounts', nargs='*')
+    replay_parser = commands.add_parser('replay', help="evalúa las reglas sobre un snapshot")
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--inactive-days', type=int, default=constants.INACTIVE_DAYS)
+    replay_parser.add_argument('--days-to-delete', type=int, default=constants.INACTIVE_DAYS_TO_DELETE)
+    replay_parser.add_argument('--now', type=datetime.fromisoformat, default=None,
+                               help="fecha de referencia ISO 8601, por defecto la fecha de captura")
+    replay_parser.add_argument('--list', action='store_true', help="imprime los usuarios seleccionados")
+    args = parser.parse_args()
+
+    if args.command == 'capture':
+        capture(args.path, args.accounts)
+        return
+    try:
+        selection_by_account = replay(args.path, args.inactive_days, args.days_to_delete, args.now)
+    except ValueError as err:
+        parser.error(str(err))
+    for account_id, selection in selection_by_account.items():
+        print(f"Cuenta {account_id}: {selection['users']} usuarios, "
+              f"{len(selection['deactivate'])} para inhabilitar, {len(selection['delete'])} para eliminar")
+        if args.list:
+            [print(f"  inhabilitar: {username}") for username in selection['deactivate']]
+            [print(f"  eliminar: {username}") for username in selection['delete']]
+
+
+if __name__ == "__main__":
+    main()
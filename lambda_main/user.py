@@ -4,7 +4,8 @@ class User:
     describen el usuario y su registro de actividad.
     """
 
-    def __init__(self, account_id, username, last_access, inactive_at, delete_at, created_at, updated_at):
+    def __init__(self, account_id, username, last_access, inactive_at, delete_at, created_at, updated_at,
+                 access_keys=None):
         """
         Crea una instancia de la clase User.
         :param account_id (str): El ID de la cuenta de AWS a la que pertenece el usuario.
@@ -18,6 +19,7 @@ class User:
             delete_at(str): La fecha y hora en que se eliminará el usuario.
             created_at(str): La fecha y hora en que se creó el usuario.
             updated_at(str): La fecha y hora en que se actualizó el usuario por última vez.
+            access_keys(list): Las fechas de creación de las access keys del usuario, None si no se consultaron.
         """
         self.account_id = account_id
         self.updated_at = updated_at
@@ -26,5 +28,6 @@ class User:
         self.inactive_at = inactive_at
         self.last_access = last_access
         self.username = username
+        self.access_keys = access_keys
 
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The Lambda modules import each other as top-level modules (as they run in the function package).
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_main'))
@@ -0,0 +1,108 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import aggregates
+
+NEW = {'account_id': '1', 'username': 'bob', 'last_access': '01/10/2026, 08:00:00', 'inactive_at': '',
+       'delete_at': '', 'created_at': '06/01/2025, 00:00:00', 'access_keys': ['06/02/2025, 00:00:00']}
+
+
+def test_delta_new_user():
+    assert aggregates.delta(None, NEW) == {'users': 1, 'access#2026-01': 1, 'key#2025-06': 1}
+
+
+def test_delta_sync_moves_access_and_keys():
+    synced = dict(NEW, last_access='03/15/2026, 09:00:00', access_keys=['03/01/2026, 00:00:00'])
+
+    assert aggregates.delta(NEW, synced) == {
+        'access#2026-01': -1, 'access#2026-03': 1, 'key#2025-06': -1, 'key#2026-03': 1}
+
+
+def test_delta_sync_without_changes_is_empty():
+    assert aggregates.delta(NEW, dict(NEW, updated_at='10/19/2026, 00:00:00')) == {}
+
+
+def test_delta_access_in_the_same_month_is_empty():
+    assert aggregates.delta(NEW, dict(NEW, last_access='01/25/2026, 18:00:00')) == {}
+
+
+def test_delta_legacy_user_without_access_keys():
+    legacy = {key: value for key, value in NEW.items() if key != 'access_keys'}
+
+    assert aggregates.delta(legacy, NEW) == {'key#2025-06': 1}
+
+
+def test_delta_never_used_user():
+    never_used = dict(NEW, last_access='El usuario no tiene password ni access key', access_keys=[])
+
+    assert aggregates.delta(None, never_used) == {'users': 1, 'never_used#2025-06': 1}
+
+
+def test_delta_deactivation():
+    deactivated = dict(NEW, inactive_at='10/01/2026, 06:00:00')
+
+    assert aggregates.delta(NEW, deactivated) == {'deactivated': 1, 'inactive#2026-10-01': 1}
+
+
+def test_delta_deletion_removes_every_bucket():
+    deactivated = dict(NEW, inactive_at='10/01/2026, 06:00:00')
+    deleted = dict(deactivated, delete_at='10/08/2026, 06:00:00')
+
+    assert aggregates.delta(deactivated, deleted) == {
+        'users': -1, 'deactivated': -1, 'deleted': 1,
+        'access#2026-01': -1, 'inactive#2026-10-01': -1, 'key#2025-06': -1}
+
+
+def test_build_matches_sum_of_deltas():
+    deactivated = dict(NEW, inactive_at='10/01/2026, 06:00:00')
+    record = aggregates.build([deactivated, dict(NEW, username='ann')])
+
+    assert record == {'users': 2, 'deactivated': 1, 'access#2026-01': 2, 'inactive#2026-10-01': 1,
+                      'key#2025-06': 2}
+
+
+@pytest.mark.parametrize('period, end', [('2026-02', date(2026, 2, 28)), ('2024-02', date(2024, 2, 29)),
+                                         ('2026-12', date(2026, 12, 31)), ('2026-10-01', date(2026, 10, 1))])
+def test_period_end(period, end):
+    assert aggregates.period_end(period) == end
+
+
+@pytest.mark.parametrize('now, inactive', [(datetime(2026, 10, 30), 1), (datetime(2026, 10, 29), 0)])
+def test_summarize_inactive_boundary(now, inactive):
+    # 30 días desde el último día del mes del último acceso ya es inactivo
+    summary = aggregates.summarize({'access#2026-09': 1}, now=now, inactive_days=30)
+
+    assert summary['inactive'] == inactive
+
+
+@pytest.mark.parametrize('now, inactive', [(datetime(2026, 10, 31), 1), (datetime(2026, 10, 30), 0)])
+def test_summarize_never_used_boundary(now, inactive):
+    # sin accesos, la creación debe superar los 30 días
+    summary = aggregates.summarize({'never_used#2026-09': 1}, now=now, inactive_days=30)
+
+    assert summary['inactive'] == inactive
+
+
+@pytest.mark.parametrize('day, pending', [('2026-10-12', 1), ('2026-10-13', 0)])
+def test_summarize_pending_deletion_boundary(day, pending):
+    summary = aggregates.summarize({f'inactive#{day}': 1}, now=datetime(2026, 10, 19), days_to_delete=7)
+
+    assert summary['pending_deletion'] == pending
+
+
+@pytest.mark.parametrize('age, label', [(89, '<90'), (90, '90-179'), (179, '90-179'), (180, '180-364'),
+                                        (364, '180-364'), (365, '>=365')])
+def test_summarize_key_age_buckets(age, label):
+    now = datetime.combine(aggregates.period_end('2025-10') + timedelta(days=age), datetime.min.time())
+
+    assert aggregates.summarize({'key#2025-10': 2}, now=now)['key_ages'][label] == 2
+
+
+def test_summarize_counters_and_key_attributes():
+    record = {'account_id': aggregates.AGGREGATES_PARTITION, 'username': '1', 'users': 3, 'deactivated': 1,
+              'deleted': 2}
+
+    summary = aggregates.summarize(record, now=datetime(2026, 10, 19))
+
+    assert (summary['users'], summary['deactivated'], summary['deleted']) == (3, 1, 2)
@@ -1,15 +1,86 @@
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
 
-from cdk_iam_cleaner.cdk_iam_cleaner_stack import CdkIamCleanerStack
+from cdk_iam_cleaner.lambda_dynamodb_stack import CdkLambdaDynamoDBStack
+from cdk_iam_cleaner.sizing import SIZING_PROFILES
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in cdk_iam_cleaner/cdk_iam_cleaner_stack.py
-def test_sqs_queue_created():
-    app = core.App()
-    stack = CdkIamCleanerStack(app, "cdk-iam-cleaner")
-    template = assertions.Template.from_stack(stack)
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+def synth(sizing=None, context=None):
+    app = core.App(context=context)
+    stack = CdkLambdaDynamoDBStack(app, "cdk-iam-cleaner", sizing=sizing)
+    return assertions.Template.from_stack(stack)
+
+
+def test_default_sizing_keeps_provisioned_table():
+    template = synth()
+
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "ProvisionedThroughput": {"ReadCapacityUnits": 1, "WriteCapacityUnits": 1}
+    })
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 0)
+
+
+def test_sizing_from_context():
+    template = synth(context={"sizing": "standard"})
+
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "BillingMode": "PAY_PER_REQUEST"
+    })
+
+
+def test_standard_sizing_uses_on_demand_table():
+    template = synth("standard")
+
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "BillingMode": "PAY_PER_REQUEST",
+        "ProvisionedThroughput": assertions.Match.absent()
+    })
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 0)
+
+
+def test_bulk_sizing_autoscales_table():
+    template = synth("bulk")
+    table = SIZING_PROFILES["bulk"]["table"]
+
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 2)
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "ScalableDimension": "dynamodb:table:ReadCapacityUnits",
+        "MinCapacity": table["read_capacity"],
+        "MaxCapacity": table["max_read_capacity"]
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "ScalableDimension": "dynamodb:table:WriteCapacityUnits",
+        "MinCapacity": table["write_capacity"],
+        "MaxCapacity": table["max_write_capacity"]
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "TargetTrackingScalingPolicyConfiguration": assertions.Match.object_like({
+            "TargetValue": table["target_utilization"]
+        })
+    })
+
+
+@pytest.mark.parametrize("sizing", sorted(SIZING_PROFILES))
+def test_function_sizing(sizing):
+    template = synth(sizing)
+    function = SIZING_PROFILES[sizing]["function"]
+    reserved = function["reserved_concurrency"]
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "MemorySize": function["memory_size"],
+        "Timeout": function["timeout"],
+        "EphemeralStorage": {"Size": function["ephemeral_storage"]},
+        "ReservedConcurrentExecutions": reserved if reserved is not None else assertions.Match.absent(),
+        "Environment": {
+            "Variables": assertions.Match.object_like({
+                "IAM_CLEANER_WORKERS": str(function["workers"]),
+                "IAM_CLEANER_BATCH_SIZE": str(function["batch_size"])
+            })
+        }
+    })
+
+
+def test_unknown_sizing_is_rejected():
+    with pytest.raises(ValueError):
+        synth("huge")
@@ -0,0 +1,189 @@
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+import aggregates
+import dynamodb
+from user import User
+
+ITEM = {'account_id': '1', 'username': 'bob', 'last_access': '01/10/2026, 08:00:00', 'inactive_at': '',
+        'delete_at': '', 'created_at': '06/01/2025, 00:00:00', 'updated_at': '01/10/2026, 08:00:00',
+        'access_keys': ['06/02/2025, 00:00:00']}
+
+
+def client_error(code, reasons=None):
+    response = {'Error': {'Code': code, 'Message': code}}
+    if reasons is not None:
+        response['CancellationReasons'] = [{'Code': reason} for reason in reasons]
+    return ClientError(response, 'Test')
+
+
+class FakeTable:
+    name = 'users'
+
+    def __init__(self, items=(), failures=()):
+        self.items = {(item['account_id'], item['username']): item for item in items}
+        self.failures = list(failures)
+        self.updates = []
+
+    def get_item(self, Key, ConsistentRead=False):
+        assert ConsistentRead
+        item = self.items.get((Key['account_id'], Key['username']))
+        return {'Item': item} if item else {}
+
+    def update_item(self, **kwargs):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.updates.append(kwargs)
+
+    def put_item(self, Item):
+        self.items[(Item['account_id'], Item['username'])] = Item
+
+    def scan(self, **kwargs):
+        return {'Items': list(self.items.values())}
+
+    def query(self, KeyConditionExpression):
+        account_id = KeyConditionExpression.get_expression()['values'][1]
+        return {'Items': [item for (partition, _), item in self.items.items() if partition == account_id]}
+
+
+class FakeClient:
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.transactions = []
+
+    def transact_write_items(self, TransactItems):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.transactions.append(TransactItems)
+
+
+def make_users(table, client):
+    users = dynamodb.Users(SimpleNamespace(meta=SimpleNamespace(client=client)))
+    users.table = table
+    return users
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(dynamodb.time, 'sleep', lambda seconds: None)
+
+
+def test_save_user_without_aggregate_changes_is_a_conditional_update():
+    table, client = FakeTable(), FakeClient()
+
+    make_users(table, client).save_user(ITEM, User('1', 'bob', ITEM['last_access'], '', '', ITEM['created_at'], '',
+                                                   ITEM['access_keys']))
+
+    assert client.transactions == []
+    assert '#p0 = :p0' in table.updates[0]['ConditionExpression']
+    assert table.updates[0]['ExpressionAttributeValues'][':p0'] == ITEM['last_access']
+
+
+def test_save_user_updates_aggregates_in_the_same_transaction():
+    table, client = FakeTable(), FakeClient()
+
+    make_users(table, client).save_user(ITEM, User('1', 'bob', '', '10/01/2026, 06:00:00', '', '', ''))
+
+    user_write, aggregate_write = client.transactions[0]
+    assert 'ConditionExpression' in user_write['Update']
+    assert aggregate_write['Update']['Key'] == {'account_id': {'S': aggregates.AGGREGATES_PARTITION},
+                                               'username': {'S': '1'}}
+    assert sorted(aggregate_write['Update']['ExpressionAttributeNames'].values()) == [
+        'deactivated', 'inactive#2026-10-01']
+
+
+def test_save_user_rereads_stale_user_before_retrying():
+    current = dict(ITEM, inactive_at='09/01/2026, 06:00:00')
+    table = FakeTable(items=[current])
+    client = FakeClient(failures=[client_error('TransactionCanceledException', ['ConditionalCheckFailed', 'None'])])
+
+    make_users(table, client).save_user(ITEM, User('1', 'bob', '', '', '10/08/2026, 06:00:00', '', ''))
+
+    changes = dict(zip(client.transactions[0][1]['Update']['ExpressionAttributeNames'].values(),
+                       client.transactions[0][1]['Update']['ExpressionAttributeValues'].values()))
+    # el delta se calcula con el usuario inhabilitado que se volvió a leer
+    assert changes['deactivated'] == {'N': '-1'}
+    assert changes['inactive#2026-09-01'] == {'N': '-1'}
+
+
+def test_save_user_retries_throttled_transactions():
+    client = FakeClient(failures=[client_error('TransactionCanceledException', ['ThrottlingError']),
+                                  client_error('ProvisionedThroughputExceededException')])
+
+    make_users(FakeTable(), client).save_user(None, User('1', 'bob', ITEM['last_access'], '', '',
+                                                         ITEM['created_at'], ''))
+
+    assert len(client.transactions) == 1
+    assert client.transactions[0][0]['Update']['ConditionExpression'] == 'attribute_not_exists(username)'
+
+
+def test_save_user_raises_other_errors():
+    table = FakeTable(failures=[client_error('ValidationException')])
+
+    with pytest.raises(ClientError):
+        make_users(table, FakeClient()).save_user(ITEM, User('1', 'bob', ITEM['last_access'], '', '',
+                                                             ITEM['created_at'], '', ITEM['access_keys']))
+
+
+def test_scan_users_excludes_aggregates():
+    table = FakeTable(items=[ITEM, {'account_id': aggregates.AGGREGATES_PARTITION, 'username': '1', 'users': 1}])
+
+    assert make_users(table, FakeClient()).scan_users({}) == [ITEM]
+
+
+def test_get_users_gives_up_on_unprocessed_keys():
+    table = FakeTable()
+    users = make_users(table, FakeClient())
+    calls = []
+
+    def batch_get_item(RequestItems):
+        calls.append(RequestItems)
+        return {'Responses': {}, 'UnprocessedKeys': RequestItems}
+
+    users.dyn_resource.batch_get_item = batch_get_item
+
+    with pytest.raises(RuntimeError):
+        users.get_users('1', ['bob'])
+    assert len(calls) == dynamodb.MAX_ATTEMPTS
+
+
+def test_ensure_aggregates_builds_record_from_legacy_items():
+    legacy = {key: value for key, value in ITEM.items() if key != 'access_keys'}
+    table, client = FakeTable(items=[legacy, dict(legacy, account_id='2')]), FakeClient()
+    users = make_users(table, client)
+
+    assert users.ensure_aggregates('1')
+    assert users.get_aggregates('1') == {'account_id': aggregates.AGGREGATES_PARTITION, 'username': '1',
+                                         'users': 1, 'access#2026-01': 1}
+    assert not users.ensure_aggregates('1')
+
+    # la primera sincronización solo agrega las access keys que el registro antiguo no tenía
+    users.save_user(legacy, User('1', 'bob', ITEM['last_access'], '', '', ITEM['created_at'], '',
+                                 ITEM['access_keys']))
+    aggregate_write = client.transactions[0][1]['Update']
+    assert list(aggregate_write['ExpressionAttributeNames'].values()) == ['key#2025-06']
+    assert list(aggregate_write['ExpressionAttributeValues'].values()) == [{'N': '1'}]
+
+
+def test_prune_aggregates_removes_empty_buckets():
+    table = FakeTable()
+    record = {'account_id': aggregates.AGGREGATES_PARTITION, 'username': '1', 'users': 0,
+              'access#2026-01': 0, 'access#2026-02': 3}
+
+    pruned = make_users(table, FakeClient()).prune_aggregates('1', record)
+
+    assert pruned == {'account_id': aggregates.AGGREGATES_PARTITION, 'username': '1', 'users': 0,
+                      'access#2026-02': 3}
+    assert table.updates[0]['UpdateExpression'] == 'REMOVE #a0'
+    assert table.updates[0]['ConditionExpression'] == '#a0 = :zero'
+    assert table.updates[0]['ExpressionAttributeNames'] == {'#a0': 'access#2026-01'}
+
+
+def test_prune_aggregates_leaves_buckets_changed_meanwhile():
+    table = FakeTable(failures=[client_error('ConditionalCheckFailedException')])
+    record = {'username': '1', 'access#2026-01': 0}
+
+    assert make_users(table, FakeClient()).prune_aggregates('1', record) == record
+    assert table.updates == []
@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import profiler
+from profiler import Profiler
+
+
+def busy_worker():
+    return sum(range(1000))
+
+
+def test_max_workers_runs_serially_when_profiling():
+    assert Profiler(True).max_workers(8) == 1
+    assert Profiler(False).max_workers(8) == 8
+
+
+def test_profile_misses_work_of_other_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler.constants, 'PROFILE_DIR', str(tmp_path))
+    instance = Profiler(True)
+
+    with instance.phase('1', 'threads'):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda _: busy_worker(), range(2)))
+    with instance.phase('1', 'serial'):
+        [busy_worker() for _ in range(2)]
+
+    threads, serial = open(instance.report()).read().split('== Cuenta: 1 | Fase: serial')
+    assert 'busy_worker' not in threads
+    assert 'busy_worker' in serial
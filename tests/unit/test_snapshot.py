@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import snapshot
+
+NOW = datetime(2026, 10, 1, tzinfo=timezone.utc)
+ACCOUNT = "111111111111"
+
+
+def days_ago(days):
+    return NOW - timedelta(days=days)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "inventory.snap")
+
+
+def test_replay_round_trip(path):
+    snapshot.write_block(path, ACCOUNT, [
+        ("active", days_ago(400), days_ago(1), None, None),
+        ("idle-key", days_ago(400), None, days_ago(30), None),
+        ("never-used", days_ago(31), None, None, None),
+        ("new", days_ago(30), None, None, None),
+        ("deactivated-due", days_ago(400), None, None, days_ago(7)),
+        ("deactivated-recent", days_ago(400), None, None, days_ago(6)),
+        ("usuario-ñ", days_ago(400), days_ago(60), days_ago(45), None),
+    ], captured_at=NOW)
+
+    result = snapshot.replay(path, inactive_days=30, days_to_delete=7)
+
+    assert result == {ACCOUNT: {
+        'users': 7,
+        'deactivate': ["idle-key", "never-used", "usuario-ñ"],
+        'delete': ["deactivated-due"],
+    }}
+
+
+def test_replay_uses_latest_block_per_account(path):
+    snapshot.write_block(path, ACCOUNT, [("old", days_ago(400), None, None, None)], captured_at=NOW)
+    snapshot.write_block(path, "222222222222", [("other", days_ago(400), None, None, None)], captured_at=NOW)
+    snapshot.write_block(path, ACCOUNT, [("new", days_ago(400), days_ago(1), None, None)],
+                         captured_at=NOW + timedelta(days=1))
+
+    result = snapshot.replay(path)
+
+    assert result[ACCOUNT] == {'users': 1, 'deactivate': [], 'delete': []}
+    assert result["222222222222"]['deactivate'] == ["other"]
+
+
+def test_replay_with_reference_date(path):
+    snapshot.write_block(path, ACCOUNT, [("user", days_ago(400), days_ago(10), None, None)], captured_at=NOW)
+
+    assert snapshot.replay(path, inactive_days=30)[ACCOUNT]['deactivate'] == []
+    later = NOW + timedelta(days=20)
+    assert snapshot.replay(path, inactive_days=30, now=later)[ACCOUNT]['deactivate'] == ["user"]
+
+
+def test_replay_skips_torn_tail(path):
+    snapshot.write_block(path, ACCOUNT, [("complete", days_ago(400), None, None, None)], captured_at=NOW)
+    snapshot.write_block(path, ACCOUNT, [("torn-username", days_ago(400), days_ago(1), None, None)],
+                         captured_at=NOW + timedelta(days=1))
+    with open(path, 'rb+') as file:
+        file.truncate(file.seek(0, 2) - 5)
+
+    assert snapshot.replay(path)[ACCOUNT]['deactivate'] == ["complete"]
+
+
+def test_replay_empty_file(path):
+    open(path, 'wb').close()
+
+    assert snapshot.replay(path) == {}
+
+
+def test_replay_rejects_other_files(path):
+    with open(path, 'wb') as file:
+        file.write(b'not a snapshot')
+
+    with pytest.raises(ValueError):
+        snapshot.replay(path)